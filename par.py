@@ -1,11 +1,80 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from cairo import Context, ImageSurface, SurfacePattern, FILTER_BEST, Matrix, LINE_CAP_SQUARE, FORMAT_ARGB32
-from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, Pango, PangoCairo
+from time import perf_counter
+from contextlib import contextmanager
+from bisect import bisect_right
+from threading import Thread, Condition
 from subprocess import call
 from math import pi
 
+import os
+import sys
+
+
+###########################################################################
+#                            Startup Profiling                            #
+###########################################################################
+
+
+def process_age():
+    """Seconds since this process was started, or None if unknown."""
+    try:
+        with open('/proc/self/stat', 'r') as handle:
+            stat = handle.read()
+        with open('/proc/uptime', 'r') as handle:
+            uptime = float(handle.read().split()[0])
+        # The command name may contain spaces, so split after it.
+        # starttime is field 22 of stat(5), in clock ticks since boot.
+        fields = stat[stat.rindex(')') + 2:].split()
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    """Collect import timings and the time until the first frame was drawn."""
+    def __init__(self):
+        age = process_age()
+        if age is None:
+            self._start, self._since = perf_counter(), 'module load'
+        else:
+            # Includes interpreter startup; /proc has clock tick resolution.
+            self._start, self._since = perf_counter() - age, 'process start'
+        self._imports = []
+        self.enabled = '--profile-startup' in sys.argv
+
+    @contextmanager
+    def measure(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._imports.append((name, perf_counter() - start))
+
+    def report(self, file=sys.stderr):
+        print('-- Startup Profile --', file=file)
+        print('time to first frame: {:8.2f}ms (since {})'.format(
+            (perf_counter() - self._start) * 1000, self._since
+        ), file=file)
+        for name, took in sorted(self._imports, key=lambda e: -e[1]):
+            print('  import {:<24} {:8.2f}ms'.format(name, took * 1000), file=file)
+
+
+STARTUP = StartupProfile()
+
+with STARTUP.measure('cairo'):
+    from cairo import Context, ImageSurface, SurfacePattern, FILTER_BEST, Matrix, LINE_CAP_SQUARE, FORMAT_ARGB32
+
+# Importing Gtk also loads the namespaces it depends on (Gdk, GLib, Pango,
+# GdkPixbuf, ...), so their load time is counted here.
+with STARTUP.measure('gi.repository.Gtk'):
+    from gi.repository import Gtk, Gdk, GLib, Pango
+
+with STARTUP.measure('gi.repository.PangoCairo'):
+    from gi.repository import PangoCairo
+
+
 ###########################################################################
 #                                 Helpers                                 #
 ###########################################################################
@@ -13,6 +82,10 @@ from math import pi
 
 ARROW_DEPTH = 7
 
+DEFAULTS = {
+    'bg_color': (0.1, 0.1, 0.1),
+    'height': 20
+}
 
 def create_dummy_context():
     return Context(ImageSurface(FORMAT_ARGB32, 5000, 100))
@@ -31,6 +104,10 @@ def parse_color(color):
         return (0, 0, 0)
 
 
+def format_color(color):
+    return '#' + ''.join('{:02x}'.format(round(c * 255)) for c in color)
+
+
 def draw_arrow_panel(ctx, color, border_color, width, height, alpha=1.0):
     ctx.set_line_width(1)
 
@@ -122,6 +199,7 @@ class Text(Widget):
     def __init__(self, markup='', font_descr='Ubuntu Mono', color=(1, 1, 1), font_size=10):
         self._markup, self._font_descr, self._color, self._font_size = markup, font_descr, color, font_size
         self._cached_bounding_box = None
+        self._layout = None
 
     def _create_layout(self, ctx):
         layout = PangoCairo.create_layout(ctx)
@@ -133,67 +211,65 @@ class Text(Widget):
 
     def bounding_box(self):
         if self._cached_bounding_box is None:
-            dummy_ctx = create_dummy_context()
-            w, h = self._create_layout(dummy_ctx).get_size()
+            # Keep the shaped layout, so render() does not have to redo it.
+            self._layout = self._create_layout(create_dummy_context())
+            w, h = self._layout.get_size()
             self._cached_bounding_box = w / Pango.SCALE, h / Pango.SCALE
         return self._cached_bounding_box
 
     def render(self, ctx, w, h):
+        self.bounding_box()
         ctx.set_source_rgb(*self._color)
-        PangoCairo.show_layout(ctx, self._create_layout(ctx))
+        PangoCairo.update_layout(ctx, self._layout)
+        PangoCairo.show_layout(ctx, self._layout)
 
 
 class Desktops(Text):
     def __init__(self, font_descr='Ubuntu Mono', desktops='1234567890', selected=[], urgents=[], empties=[], command='bspc desktop {num} -f'):
-        self._font_descr = font_descr
         self._command = command
-        self._text_widgets = []
+
+        # All desktops go into a single layout; each one is a span with its
+        # own colour. _index_ends stores the byte offset where each desktop
+        # ends in the layout's text, used to map clicks back to desktops.
+        self._index_ends = []
+        fragments, offset = [], 0
         for idx, desktop in enumerate(desktops):
-            markup = desktop
             if idx in selected:
-                markup = '<big><u>' + markup + '</u></big>'
-                color = (0, 0, 0)
+                color, extra = (0, 0, 0), ' size="larger" underline="single"'
             elif idx in urgents:
-                color = (0.8, 0.4, 0.4)
+                color, extra = (0.8, 0.4, 0.4), ''
             elif idx in empties:
-                color = (0.8, 0.8, 0.8)
+                color, extra = (0.8, 0.8, 0.8), ''
             else:
-                color = (0.2, 0.3, 0.4)
-            self._text_widgets.append(Text(markup=markup, color=color))
+                color, extra = (0.2, 0.3, 0.4), ''
 
-    def bounding_box(self):
-        sum_w = 0
-        max_h = 0
-        for widget in self._text_widgets:
-            w, h = widget.bounding_box()
-            sum_w += w
-            max_h = max(max_h, h)
-        return sum_w, max_h
+            fragments.append('<span foreground="{}"{}>{}</span>'.format(
+                format_color(color), extra, GLib.markup_escape_text(desktop)
+            ))
+            offset += len(desktop.encode('utf-8'))
+            self._index_ends.append(offset)
 
-    def render(self, ctx, w, h):
-        ctx.save()
-        for idx, widget in enumerate(self._text_widgets):
-            ww, wh = widget.bounding_box()
-            widget.render(ctx, w, h)
-            ctx.translate(ww, 0)
-        ctx.restore()
+        Text.__init__(self, markup=''.join(fragments), font_descr=font_descr)
 
     def handle_click(self, x):
-        sum_w = 0
-        for idx, widget in enumerate(self._text_widgets):
-            ww, wh = widget.bounding_box()
-            sum_w += ww
-            if x <= sum_w:
-                if '{num}' in self._command:
-                    command = self._command.format(num=idx)
-                else:
-                    command = self._command
-                try:
-                    call(command, shell=True)
-                except OSError as err:
-                    print(err)
-                finally:
-                    break
+        # Hit-test on the same layout that was measured and drawn.
+        _, h = self.bounding_box()
+        inside, index, _ = self._layout.xy_to_index(
+            int(x * Pango.SCALE), int(h / 2 * Pango.SCALE)
+        )
+        if not inside:
+            return
+
+        idx = bisect_right(self._index_ends, index)
+        if '{num}' in self._command:
+            command = self._command.format(num=idx)
+        else:
+            command = self._command
+
+        try:
+            call(command, shell=True)
+        except OSError as err:
+            print(err)
 
 
 class Icon(Widget):
@@ -235,16 +311,19 @@ class Separator(Widget):
 class Container(Widget):
     def __init__(self, pos=0.0, padding=(0, 0), widgets=[]):
         self._pos, self._padding, self._widgets = pos, padding, widgets
+        self._cached_bounding_box = None
 
     def get_pos(self):
         return self._pos
 
     def bounding_box(self):
-        sum_w = 0
-        for widget in self._widgets:
-            w, h = widget.bounding_box()
-            sum_w += w
-        return sum_w + sum(self._padding), -1
+        if self._cached_bounding_box is None:
+            sum_w = 0
+            for widget in self._widgets:
+                w, h = widget.bounding_box()
+                sum_w += w
+            self._cached_bounding_box = sum_w + sum(self._padding), -1
+        return self._cached_bounding_box
 
     def frag(self, x):
         sum_w = 0
@@ -313,12 +392,103 @@ def render_container_list(ctx, containers, abs_width, abs_height):
         ctx.restore()
 
 
+def draw_frame(ctx, containers, defaults, abs_width, abs_height):
+    ctx.set_source_rgb(*(defaults.get('bg_color') or (0.23, 0.23, 0.23)))
+    ctx.paint()
+    render_container_list(ctx, containers, abs_width, abs_height)
+
+
+def parse_line(line):
+    """Evaluate a line of par_writer output to a list of containers.
+
+    Returns None if the line could not be evaluated.
+    """
+    allowed = [Widget, Bar, Text, Icon, Desktops, Separator, Container, ArrowBox, parse_color]
+    try:
+        return eval(line, {k.__name__: k for k in allowed})
+    except Exception as err:
+        print(line)
+        print('-> Unable to execute:', err)
+        return None
+
+
+class FrontBuffer:
+    """Generation of the tree on screen; only newer trees are swapped in."""
+    def __init__(self):
+        self.generation = 0
+
+    def swap(self, generation):
+        if generation <= self.generation:
+            return False
+        self.generation = generation
+        return True
+
+
+class LineDecoder:
+    """Evaluate and measure lines on a worker thread.
+
+    Only the newest line is decoded; lines arriving while the worker is busy
+    replace the one still pending. Every tree the worker starts on is
+    finished and passed to on_ready(generation, containers) from the worker
+    thread; the receiver decides with a FrontBuffer whether it is still newer
+    than what is shown. If given, on_failed(generation) is called for lines
+    that could not be decoded.
+    """
+    def __init__(self, on_ready, on_failed=None):
+        self._on_ready, self._on_failed = on_ready, on_failed
+        self._cond = Condition()
+        self._pending = None
+        self._generation = 0
+        self._thread = Thread(target=self._run, name='par-decoder', daemon=True)
+        self._thread.start()
+
+    def feed(self, line):
+        with self._cond:
+            self._pending = line
+            self._generation += 1
+            self._cond.notify()
+            return self._generation
+
+    def _decode(self, line, generation):
+        containers = parse_line(line)
+        if containers is None:
+            return False
+
+        # Measure everything here, so the main loop only reads caches.
+        for container in containers:
+            container.bounding_box()
+        self._on_ready(generation, containers)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                line, generation = self._pending, self._generation
+                self._pending = None
+
+            # Never let a bad line kill the worker; the bar would freeze.
+            try:
+                decoded = self._decode(line, generation)
+            except Exception as err:
+                print(line)
+                print('-> Unable to execute:', err)
+                decoded = False
+
+            if not decoded and self._on_failed is not None:
+                self._on_failed(generation)
+
+
 class ElchBar(Gtk.Window):
     def __init__(self, defaults, file_object):
         Gtk.Window.__init__(self)
 
         self._defaults = defaults
         self._containers = []
+        self._front = FrontBuffer()
+        self._first_frame_drawn = False
+        self._decoder = LineDecoder(self._on_decoded)
 
         self._canvas = Gtk.DrawingArea()
         self._canvas.set_size_request(1920, defaults.get('height', 20))
@@ -368,24 +538,29 @@ class ElchBar(Gtk.Window):
         return True
 
     def _on_draw(self, canvas, ctx):
-        ctx.set_source_rgb(*(self._defaults.get('bg_color') or (0.23, 0.23, 0.23)))
-        ctx.paint()
-
         alloc = canvas.get_allocation()
 
-        render_container_list(
-                ctx, self._containers, alloc.width, alloc.height
+        draw_frame(
+                ctx, self._containers, self._defaults, alloc.width, alloc.height
         )
 
-    def _load_line(self, line):
-        allowed = [Widget, Bar, Text, Icon, Desktops, Separator, Container, ArrowBox, parse_color]
-        try:
-            containers = eval(line, {k.__name__: k for k in allowed})
-        except Exception as err:
-            print(line)
-            print('-> Unable to execute:', err)
-        else:
+        if self._containers and not self._first_frame_drawn:
+            self._first_frame_drawn = True
+            if STARTUP.enabled:
+                STARTUP.report()
+                GLib.idle_add(self._quit)
+
+    def _on_decoded(self, generation, containers):
+        # Called from the decoder thread; hand over to the main loop.
+        GLib.idle_add(self._swap, generation, containers)
+
+    def _swap(self, generation, containers):
+        if self._front.swap(generation):
             self.push(containers)
+        return False
+
+    def _load_line(self, line):
+        self._decoder.feed(line)
 
     def _quit(self):
         Gtk.main_quit()
@@ -413,18 +588,13 @@ class ElchBar(Gtk.Window):
 ###########################################################################
 
 if __name__ == '__main__':
-    import sys
-    defaults = {
-        'bg_color': (0.1, 0.1, 0.1),
-        'height': 20
-    }
-
-    if len(sys.argv) < 2:
-        print('Usage: par.py fifo-path')
+    args = [arg for arg in sys.argv[1:] if arg != '--profile-startup']
+    if len(args) < 1:
+        print('Usage: par.py [--profile-startup] fifo-path')
     else:
         try:
-            with open(sys.argv[1], 'r') as f:
-                bar = ElchBar(defaults, f)
+            with open(args[0], 'r') as f:
+                bar = ElchBar(DEFAULTS, f)
                 Gtk.main()
         except KeyboardInterrupt:
             print('Ctrl-C')
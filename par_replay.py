@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+'''
+Record the output of par_writer.py and replay it through par.py's render path.
+
+Recording (the stream is passed on to stdout unchanged):
+
+    $ python -u par_writer.py | python par_replay.py record bar.rec > /tmp/par-fifo
+
+Replaying (headless, no window or display needed):
+
+    $ python par_replay.py replay bar.rec               # real time
+    $ python par_replay.py replay bar.rec --speed 60    # 60x accelerated
+    $ python par_replay.py replay bar.rec --speed 0 --loops 100  # flat out
+
+Every --report-every frames a line with frame latency, RSS and object
+counts is printed, followed by a summary at the end.
+'''
+
+from collections import Counter
+from time import perf_counter, sleep
+
+import argparse
+import gc
+import os
+import sys
+
+
+###########################################################################
+#                                Recording                                #
+###########################################################################
+
+def record(in_file, out_file, passthrough=sys.stdout):
+    start = perf_counter()
+    for line in in_file:
+        out_file.write('{:.6f}\t{}'.format(perf_counter() - start, line))
+        out_file.flush()
+        if passthrough is not None:
+            passthrough.write(line)
+            passthrough.flush()
+
+
+def read_recording(path):
+    frames = []
+    with open(path, 'r') as handle:
+        for line in handle:
+            stamp, _, payload = line.partition('\t')
+            if payload:
+                frames.append((float(stamp), payload))
+    return frames
+
+
+###########################################################################
+#                              Measurements                               #
+###########################################################################
+
+def read_rss():
+    """Resident set size of this process in bytes (peak RSS without /proc)."""
+    try:
+        with open('/proc/self/statm', 'r') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the peak, in kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_objects():
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class Sample:
+    def __init__(self, frame, latencies):
+        self.frame = frame
+        self.rss = read_rss()
+        self.objects = count_objects()
+        self.latencies = sorted(latencies)
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0
+        return self.latencies[int(fraction * (len(self.latencies) - 1))]
+
+    def format(self, baseline):
+        growth = self.objects - baseline.objects
+        top = ', '.join('{}+{}'.format(name, n) for name, n in growth.most_common(3))
+        return 'frame {:7d}  p50 {:6.2f}ms  p99 {:6.2f}ms  max {:6.2f}ms  rss {:7.1f}MiB ({:+.1f})  objects {:8d} ({:+d}) {}'.format(
+            self.frame,
+            self.percentile(0.5) * 1000,
+            self.percentile(0.99) * 1000,
+            self.percentile(1.0) * 1000,
+            self.rss / 1024 ** 2,
+            (self.rss - baseline.rss) / 1024 ** 2,
+            sum(self.objects.values()),
+            sum(self.objects.values()) - sum(baseline.objects.values()),
+            top
+        )
+
+
+###########################################################################
+#                                Replaying                                #
+###########################################################################
+
+def replay(frames, speed=1.0, loops=1, report_every=100, width=1920, out=sys.stdout):
+    # Imported here, so recording does not need Gtk, Pango or cairo.
+    from cairo import Context, ImageSurface, FORMAT_ARGB32
+    from queue import Queue, Empty
+    import par
+
+    height = par.DEFAULTS.get('height', 20)
+    surface = ImageSurface(FORMAT_ARGB32, width, height)
+
+    # Lines go through the same LineDecoder as in ElchBar._load_line();
+    # the queue stands in for GLib.idle_add() handing trees to the main loop.
+    results = Queue()
+    decoder = par.LineDecoder(
+        lambda generation, containers: results.put((generation, containers)),
+        lambda generation: results.put((generation, None))
+    )
+
+    gc.collect()
+    baseline = Sample(0, [])
+    latencies, all_latencies = [], []
+    fed_at = {}
+    stats = {'drawn': 0, 'failed': 0, 'handled': 0}
+    front = par.FrontBuffer()
+    started = perf_counter()
+
+    def swap(generation, containers):
+        # Decided by the same FrontBuffer as in ElchBar._swap(), then drawn.
+        stats['handled'] = max(stats['handled'], generation)
+        fed = fed_at.pop(generation)
+        for older in [g for g in fed_at if g < generation]:
+            del fed_at[older]  # Dropped as stale; would leak otherwise.
+
+        if containers is None:
+            stats['failed'] += 1
+        elif front.swap(generation):
+            par.draw_frame(Context(surface), containers, par.DEFAULTS, width, height)
+            surface.flush()
+
+            # Latency from feeding the line until its frame was drawn.
+            took = perf_counter() - fed
+            latencies.append(took)
+            all_latencies.append(took)
+            stats['drawn'] += 1
+
+            if report_every and stats['drawn'] % report_every == 0:
+                print(Sample(stats['drawn'], latencies).format(baseline), file=out)
+                del latencies[:]
+
+    def pump(deadline=None, generation=None):
+        # Handle finished trees until deadline passed or generation is done.
+        while generation is None or stats['handled'] < generation:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - perf_counter()
+                if timeout <= 0:
+                    return
+            try:
+                swap(*results.get(timeout=timeout))
+            except Empty:
+                return
+
+    fed = 0
+    for _ in range(loops):
+        loop_start = perf_counter()
+        for stamp, line in frames:
+            if speed > 0:
+                pump(deadline=loop_start + stamp / speed)
+
+            fed_time = perf_counter()
+            generation = decoder.feed(line)
+            fed_at[generation] = fed_time
+            fed += 1
+
+            # Flat out: wait for each line, so none of them are dropped.
+            if speed <= 0:
+                pump(generation=generation)
+
+    if fed:
+        pump(generation=fed)
+
+    total = perf_counter() - started
+    gc.collect()
+    print('-- Summary --', file=out)
+    print(Sample(stats['drawn'], all_latencies).format(baseline), file=out)
+    print('{} lines: {} drawn, {} failed, {} superseded in {:.2f}s: {:.1f} frames/s'.format(
+        fed, stats['drawn'], stats['failed'], fed - stats['drawn'] - stats['failed'],
+        total, stats['drawn'] / total if total else 0
+    ), file=out)
+
+
+###########################################################################
+#                                  Main                                   #
+###########################################################################
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Record and replay par.py input.')
+    commands = parser.add_subparsers(dest='command')
+
+    rec = commands.add_parser('record', help='Timestamp lines from stdin into a file')
+    rec.add_argument('path')
+    rec.add_argument('--quiet', action='store_true', help='Do not pass lines on to stdout')
+
+    rep = commands.add_parser('replay', help='Feed a recording through the headless renderer')
+    rep.add_argument('path')
+    rep.add_argument('--speed', type=float, default=1.0, help='1 is real time, 0 is flat out')
+    rep.add_argument('--loops', type=int, default=1, help='Replay the recording this often')
+    rep.add_argument('--report-every', type=int, default=100, help='Frames between reports')
+    rep.add_argument('--width', type=int, default=1920)
+
+    args = parser.parse_args(argv)
+    if args.command == 'record':
+        with open(args.path, 'w') as out_file:
+            record(sys.stdin, out_file, None if args.quiet else sys.stdout)
+    elif args.command == 'replay':
+        replay(
+            read_recording(args.path), speed=args.speed, loops=args.loops,
+            report_every=args.report_every, width=args.width
+        )
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv[1:])
+    except KeyboardInterrupt:
+        print('Ctrl-C')
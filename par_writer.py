@@ -40,20 +40,39 @@ BAR_TEMPLATE = '''
 ]
 '''
 
-from gi.repository import GLib
-from telnetlib import Telnet
 from select import select
 from time import strftime, time, sleep
 
 import sys
 import socket
-import subprocess
 
 
 ###########################################################################
 #                            Helper Functions                             #
 ###########################################################################
 
+MARKUP_ESCAPES = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    "'": '&#39;',
+    '"': '&quot;'
+})
+
+# Control characters are not allowed raw in markup; escaped like GLib does.
+MARKUP_ESCAPES.update({
+    c: '&#x{:x};'.format(c) for c in [
+        *range(0x01, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20),
+        0x7f, *range(0x80, 0x85), *range(0x86, 0xa0)
+    ]
+})
+
+
+def markup_escape_text(text):
+    # Same as GLib.markup_escape_text(), but without pulling in GObject.
+    return text.translate(MARKUP_ESCAPES)
+
+
 def format_time_string():
     return strftime('<b><big>%H:%M</big>:%S</b>')
 
@@ -113,6 +132,9 @@ class MPDSource():
             return b''
 
     def connect(self):
+        # Deferred, so the first frame does not wait for it.
+        from telnetlib import Telnet
+
         try:
             self._conn = Telnet(host=self._host, port=self._port)
         except socket.error as err:
@@ -136,9 +158,9 @@ class MPDSource():
         self._is_playing = unstopped = info['state'] in ['play', 'pause']
         if unstopped:
             markup = '<i> {title}<small> by </small>{artist}<small> on </small>{album} </i>'.format(
-                title=GLib.markup_escape_text(info.get('title', 'n/a')),
-                artist=GLib.markup_escape_text(info.get('artist', 'n/a')),
-                album=GLib.markup_escape_text(info.get('album', 'n/a'))
+                title=markup_escape_text(info.get('title', 'n/a')),
+                artist=markup_escape_text(info.get('artist', 'n/a')),
+                album=markup_escape_text(info.get('album', 'n/a'))
             )
             self._last_elapsed = float(info.get('elapsed', 0))
 
@@ -208,6 +230,8 @@ class BspwmPanelFIFO:
         return last_line
 
     def connect(self):
+        import subprocess
+
         self._proc = subprocess.Popen(
             'bspc control --subscribe',
             shell=True, stdout=subprocess.PIPE